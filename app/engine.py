@@ -2,13 +2,26 @@
 from __future__ import annotations
 
 import asyncio
+import contextvars
+import os
+import sys
+import time
 import uuid
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from enum import Enum
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from fastapi.concurrency import run_in_threadpool
-from pydantic import BaseModel, Field
+from pydantic import BaseModel
+
+
+# Worker threads for blocking (non cpu_light) sync tools, kept separate
+# from the anyio pool FastAPI uses for its own sync endpoints/dependencies
+_engine_pool = ThreadPoolExecutor(
+    max_workers=(os.cpu_count() or 1) * 4, thread_name_prefix="engine"
+)
 
 
 class NodeConfig(BaseModel):
@@ -45,55 +58,338 @@ class RunStatus(str, Enum):
     FAILED = "failed"
 
 
-class StepLog(BaseModel):
+@dataclass(slots=True)
+class StepLog:
+    """
+    One executed step.
+
+    - t_ns: time.monotonic_ns() when the step finished;
+      see RunState.timestamp_of() for wall-clock time
+    - delta: the dict returned by the node's tool
+    - version: state version after applying delta (initial state is 0)
+    """
     step_index: int
     node: str
-    timestamp: datetime
-    state: Dict[str, Any]
+    t_ns: int
+    version: int
+    delta: Dict[str, Any]
+
 
+@dataclass(slots=True)
+class RunState:
+    """
+    Internal record of one workflow run.
 
-class RunState(BaseModel):
+    Built and mutated only by the engine, so it is a plain dataclass
+    rather than a validated Pydantic model.
+    """
     id: str
     graph_id: str
     status: RunStatus
+    started_at: datetime
+    started_ns: int
     current_node: Optional[str] = None
-    state: Dict[str, Any] = Field(default_factory=dict)
-    log: List[StepLog] = Field(default_factory=list)
+    initial_state: Dict[str, Any] = field(default_factory=dict)
+    params: Dict[str, Any] = field(default_factory=dict)
+    state: Dict[str, Any] = field(default_factory=dict)
+    log: List[StepLog] = field(default_factory=list)
     error: Optional[str] = None
 
+    def timestamp_of(self, step: StepLog) -> datetime:
+        """Wall-clock (UTC) time at which `step` finished."""
+        return self.started_at + timedelta(
+            microseconds=(step.t_ns - self.started_ns) // 1000
+        )
+
+    def snapshot_at(self, step_index: int) -> Dict[str, Any]:
+        """Rebuild the full state as it was right after `step_index`."""
+        if not 0 <= step_index < len(self.log):
+            raise IndexError("step_index out of range")
+
+        snapshot = dict(self.initial_state)
+        for step in self.log[: step_index + 1]:
+            snapshot.update(step.delta)
+        return snapshot
+
+
+ToolFunc = Callable[[Dict[str, Any]], Any]
+
+# Declared tool parameter: (coerce function, default), e.g. (int, 80)
+ParamDecl = Tuple[Callable[[Any], Any], Any]
+
+# Params of the run currently executing, coerced once at run start
+run_params: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar(
+    "run_params"
+)
+
+
+def _coerce_param(name: str, coerce: Callable[[Any], Any], raw: Any) -> Any:
+    try:
+        return coerce(raw)
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f"param '{name}': {exc}") from exc
+
+
+@dataclass(slots=True)
+class ToolEntry:
+    """A registered tool plus the flags the engine dispatches on."""
+    func: ToolFunc
+    is_coro: bool
+    cpu_light: bool
+    yield_after: bool
+    params: Dict[str, ParamDecl]
+
 
 class ToolRegistry:
     """
     Simple tool registry.
 
     Each tool is a sync or async function:  (state: dict) -> dict
+
+    Tools get the run's live state dict (no per-step copy) and must treat
+    it as read-only, returning only the keys they change. The returned dict
+    is both merged into the state and kept as that step's log delta.
+
+    Sync tools registered with cpu_light=True are called inline on the
+    event loop; other sync tools are dispatched to a worker thread. Only
+    mark tools cpu_light if they are non-blocking and finish in well under
+    a millisecond; anything slower should stay on the thread pool.
+    yield_after=True makes an inline tool yield to the event loop once it
+    returns, so a tool that runs in a loop does not starve other requests
+    across iterations; it does not break up a single long call.
+
+    params declares the state keys a tool reads as settings, as
+    {name: (coerce, default)}; tools read them with read_params(). Params
+    are run inputs only: run_graph coerces them from the initial state once
+    at run start, and a node that later writes one of those keys does not
+    change the value tools see for the rest of the run.
     """
 
     def __init__(self) -> None:
-        self._tools: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
-
-    def register(self, name: str):
+        self._tools: Dict[str, ToolEntry] = {}
+
+    def register(
+        self,
+        name: str,
+        cpu_light: bool = False,
+        yield_after: bool = False,
+        params: Optional[Dict[str, ParamDecl]] = None,
+    ):
         """Decorator to register a tool."""
 
-        def decorator(func: Callable[[Dict[str, Any]], Any]):
-            self._tools[name] = func
+        def decorator(func: ToolFunc):
+            self._tools[name] = ToolEntry(
+                func=func,
+                is_coro=asyncio.iscoroutinefunction(func),
+                cpu_light=cpu_light,
+                yield_after=yield_after,
+                params=dict(params or {}),
+            )
             return func
 
         return decorator
 
-    def get(self, name: str) -> Optional[Callable[[Dict[str, Any]], Any]]:
+    def get(self, name: str) -> Optional[ToolEntry]:
         return self._tools.get(name)
 
+    def read_params(self, name: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Coerced params for tool `name`: the current run's inside run_graph,
+        otherwise read from `state` (e.g. when a tool is called directly).
+        """
+        values = run_params.get(None)
+        if values is None:
+            values = {
+                param: _coerce_param(param, coerce, state.get(param, default))
+                for param, (coerce, default) in self._tools[name].params.items()
+            }
+        return values
+
+
+STOP = -1  # node id meaning "end the workflow"
+MAX_STEPS = 1000  # per-run step limit for graphs that contain loops
+
+# Picks the next node id after a node has run, given the run's bound
+# state.get
+StepFunc = Callable[[Callable[..., Any]], int]
+
+
+@dataclass(slots=True)
+class CompiledGraph:
+    """
+    Flat, index-based form of a GraphConfig used by run_graph.
+
+    Node i is described by index i of every list; edges are node ids,
+    with STOP for "end the workflow". Tools are resolved when the graph
+    is compiled, so re-registering a tool needs GraphEngine.recompile_graph().
+
+    step_fn[i] is node i's routing specialised to its shape: a constant
+    for plain `next` edges, a condition_key lookup for branching nodes.
+
+    has_loops is False when no cycle is reachable from the start node, in
+    which case a run visits each node at most once.
+
+    params_schema merges the params declared by the graph's tools.
+    """
+    start_id: int
+    node_name: List[str]
+    tool_fn: List[ToolEntry]
+    next_id: List[int]
+    cond_key: List[Optional[str]]
+    true_id: List[int]
+    false_id: List[int]
+    step_fn: List[StepFunc]
+    has_loops: bool
+    params_schema: Dict[str, ParamDecl]
+
+
+def _check_loops(start: int, succ: List[List[int]], node_name: List[str]) -> bool:
+    """
+    Find the cycles reachable from `start` (Tarjan's SCC algorithm).
+
+    `succ[i]` lists node i's possible next ids, STOP included. Returns
+    whether any cycle is reachable; raises ValueError for a cycle that
+    no edge leaves, since a run entering it can never finish.
+    """
+    index: Dict[int, int] = {start: 0}
+    low: Dict[int, int] = {start: 0}
+    stack: List[int] = [start]
+    on_stack = {start}
+    work = [(start, iter(succ[start]))]
+    has_loops = False
+
+    while work:
+        v, edges = work[-1]
+        for w in edges:
+            if w == STOP:
+                continue
+            if w not in index:
+                index[w] = low[w] = len(index)
+                stack.append(w)
+                on_stack.add(w)
+                work.append((w, iter(succ[w])))
+                break
+            if w in on_stack:
+                low[v] = min(low[v], index[w])
+        else:
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[v])
+            if low[v] != index[v]:
+                continue
+
+            members = set()
+            while True:
+                w = stack.pop()
+                on_stack.discard(w)
+                members.add(w)
+                if w == v:
+                    break
+
+            if len(members) == 1 and v not in succ[v]:
+                continue
+            has_loops = True
+
+            if all(w in members for u in members for w in succ[u]):
+                path = [node_name[v]]
+                seen = {v}
+                u = v
+                while True:
+                    u = next(w for w in succ[u] if w in members)
+                    path.append(node_name[u])
+                    if u in seen:
+                        break
+                    seen.add(u)
+                raise ValueError(f"cycle with no way out: {' -> '.join(path)}")
+
+    return has_loops
+
 
 class GraphEngine:
     """
     Minimal in-memory workflow engine.
     """
 
-    def __init__(self, tools: ToolRegistry) -> None:
+    def __init__(self, tools: ToolRegistry, max_runs: int = 10_000) -> None:
         self.tools = tools
         self.graphs: Dict[str, GraphConfig] = {}
-        self.runs: Dict[str, RunState] = {}
+        self.compiled: Dict[str, CompiledGraph] = {}
+        # Only the most recent `max_runs` runs are kept; older ones are evicted
+        self.max_runs = max_runs
+        self.runs: OrderedDict[str, RunState] = OrderedDict()
+
+    def _compile(self, config: GraphConfig) -> CompiledGraph:
+        ids = {n.name: i for i, n in enumerate(config.nodes)}
+
+        def node_id(source: str, target: Optional[str]) -> int:
+            if target is None:
+                return STOP
+            if target not in ids:
+                raise ValueError(
+                    f"node '{source}' references unknown node '{target}'"
+                )
+            return ids[target]
+
+        params_schema: Dict[str, ParamDecl] = {}
+
+        def tool_entry(node: NodeConfig) -> ToolEntry:
+            tool = self.tools.get(node.tool)
+            if tool is None:
+                raise ValueError(
+                    f"node '{node.name}' uses unregistered tool '{node.tool}'"
+                )
+            for param, decl in tool.params.items():
+                if params_schema.setdefault(param, decl) != decl:
+                    raise ValueError(
+                        f"tool '{node.tool}' declares param '{param}' "
+                        "differently from another tool in the graph"
+                    )
+            return tool
+
+        nodes = config.nodes
+        next_id = [node_id(n.name, n.next) for n in nodes]
+        # interned so state lookups can match keys by identity
+        cond_key = [
+            None if n.condition_key is None else sys.intern(n.condition_key)
+            for n in nodes
+        ]
+        true_id = [node_id(n.name, n.next_if_true) for n in nodes]
+        false_id = [node_id(n.name, n.next_if_false) for n in nodes]
+
+        def make_step(i: int) -> StepFunc:
+            key = cond_key[i]
+            if key is None:
+                nxt = next_id[i]
+                return lambda get: nxt
+
+            # indexed by the truthiness of the condition value
+            branches = (false_id[i], true_id[i])
+
+            def branch(get: Callable[..., Any]) -> int:
+                return branches[bool(get(key))]
+
+            return branch
+
+        start_id = ids[config.start_node]
+        succ = [
+            [next_id[i]] if cond_key[i] is None else [true_id[i], false_id[i]]
+            for i in range(len(nodes))
+        ]
+        node_name = [n.name for n in nodes]
+
+        return CompiledGraph(
+            start_id=start_id,
+            node_name=node_name,
+            tool_fn=[tool_entry(n) for n in nodes],
+            next_id=next_id,
+            cond_key=cond_key,
+            true_id=true_id,
+            false_id=false_id,
+            step_fn=[make_step(i) for i in range(len(nodes))],
+            has_loops=_check_loops(start_id, succ, node_name),
+            params_schema=params_schema,
+        )
 
     def create_graph(self, config: GraphConfig) -> str:
         graph_id = str(uuid.uuid4())
@@ -107,9 +403,15 @@ class GraphEngine:
         if len(node_names) != len(config.nodes):
             raise ValueError("node names must be unique")
 
+        compiled = self._compile(config)
         self.graphs[graph_id] = config
+        self.compiled[graph_id] = compiled
         return graph_id
 
+    def recompile_graph(self, graph_id: str) -> None:
+        """Re-resolve a graph's tools, e.g. after re-registering one."""
+        self.compiled[graph_id] = self._compile(self.get_graph(graph_id))
+
     def get_graph(self, graph_id: str) -> GraphConfig:
         graph = self.graphs.get(graph_id)
         if not graph:
@@ -123,16 +425,28 @@ class GraphEngine:
         return run
 
     async def _call_tool(
-        self, tool: Callable[[Dict[str, Any]], Any], state: Dict[str, Any]
+        self, tool: ToolEntry, state: Dict[str, Any]
     ) -> Dict[str, Any]:
         # Support both sync and async tools
-        if asyncio.iscoroutinefunction(tool):
-            result = await tool(state)
+        if tool.is_coro:
+            result = await tool.func(state)
+        elif tool.cpu_light:
+            result = tool.func(state)
+            if tool.yield_after:
+                await asyncio.sleep(0)
         else:
-            result = await run_in_threadpool(tool, state)
-
-        if not isinstance(result, dict):
-            raise RuntimeError("Tool must return a dict representing new/updated state")
+            # Copy the context so contextvars are visible in the worker thread
+            ctx = contextvars.copy_context()
+            result = await asyncio.get_running_loop().run_in_executor(
+                _engine_pool, ctx.run, tool.func, state
+            )
+
+        # Checked in development only; stripped when running under -O
+        if __debug__:
+            if not isinstance(result, dict):
+                raise RuntimeError(
+                    "Tool must return a dict representing new/updated state"
+                )
         return result
 
     async def run_graph(
@@ -146,60 +460,67 @@ class GraphEngine:
             graph_id=graph_id,
             status=RunStatus.RUNNING,
             current_node=graph.start_node,
+            started_at=datetime.utcnow(),
+            started_ns=time.monotonic_ns(),
+            initial_state=dict(initial_state),
             state=dict(initial_state),
             log=[],
         )
         self.runs[run_id] = run_state
+        if len(self.runs) > self.max_runs:
+            self.runs.popitem(last=False)
 
-        nodes_by_name: Dict[str, NodeConfig] = {n.name: n for n in graph.nodes}
-        current_node_name: Optional[str] = graph.start_node
+        compiled = self.compiled[graph_id]
+        node_name = compiled.node_name
+        tool_fn = compiled.tool_fn
+        step_fn = compiled.step_fn
 
-        step_index = 0
-        max_steps = 1000  # safety guard against infinite loops
+        state = run_state.state
+        state_get = state.get
+        log_append = run_state.log.append
+        now_ns = time.monotonic_ns
+        cur = compiled.start_id
 
-        try:
-            while current_node_name is not None:
-                if step_index >= max_steps:
-                    raise RuntimeError("Max steps exceeded, possible infinite loop")
+        # Without loops every node runs at most once, so the node count is an
+        # exact bound; otherwise guard against (conditional) infinite loops
+        max_steps = MAX_STEPS if compiled.has_loops else len(node_name)
 
-                node_cfg = nodes_by_name.get(current_node_name)
-                if node_cfg is None:
-                    raise RuntimeError(f"Node '{current_node_name}' not found")
+        params_token = None
+        try:
+            run_state.params = {
+                param: _coerce_param(param, coerce, state.get(param, default))
+                for param, (coerce, default) in compiled.params_schema.items()
+            }
+            params_token = run_params.set(run_state.params)
 
-                run_state.current_node = current_node_name
+            for step_index in range(max_steps):
+                if cur == STOP:
+                    break
 
-                tool = self.tools.get(node_cfg.tool)
-                if tool is None:
-                    raise RuntimeError(f"Tool '{node_cfg.tool}' not registered")
+                name = node_name[cur]
+                run_state.current_node = name
 
                 # Call node (tool) to update shared state
-                new_state = await self._call_tool(tool, run_state.state)
-                run_state.state.update(new_state)
+                new_state = await self._call_tool(tool_fn[cur], state)
+                state.update(new_state)
 
-                # Log snapshot after node execution
-                run_state.log.append(
+                # Log only what this node changed; full snapshots are
+                # rebuilt on demand via RunState.snapshot_at()
+                log_append(
                     StepLog(
                         step_index=step_index,
-                        node=current_node_name,
-                        timestamp=datetime.utcnow(),
-                        state=dict(run_state.state),
+                        node=name,
+                        t_ns=now_ns(),
+                        version=step_index + 1,
+                        delta=new_state,
                     )
                 )
 
                 # Decide next node (branching + looping)
-                next_node: Optional[str]
-                if node_cfg.condition_key is not None:
-                    cond_value = bool(
-                        run_state.state.get(node_cfg.condition_key, False)
-                    )
-                    next_node = (
-                        node_cfg.next_if_true if cond_value else node_cfg.next_if_false
-                    )
-                else:
-                    next_node = node_cfg.next
-
-                current_node_name = next_node
-                step_index += 1
+                cur = step_fn[cur](state_get)
+            else:
+                if cur != STOP:
+                    raise RuntimeError("Max steps exceeded, possible infinite loop")
 
             run_state.status = RunStatus.COMPLETED
             run_state.current_node = None
@@ -208,4 +529,8 @@ class GraphEngine:
             run_state.status = RunStatus.FAILED
             run_state.error = str(exc)
 
+        finally:
+            if params_token is not None:
+                run_params.reset(params_token)
+
         return run_state
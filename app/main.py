@@ -1,9 +1,11 @@
 # app/main.py
 from __future__ import annotations
 
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, Iterator, Literal, Optional
 
-from fastapi import FastAPI, HTTPException
+import msgspec
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from .engine import GraphConfig, GraphEngine, RunState
@@ -34,10 +36,14 @@ class GraphRunRequest(BaseModel):
 
 
 class GraphRunResponse(BaseModel):
+    """
+    Documents the /graph/run body; the endpoint encodes it with msgspec
+    and streams it when a log is requested.
+    """
     run_id: str
     final_state: Dict[str, Any]
     status: str
-    log: Any
+    log: Any = None
 
 
 class GraphStateResponse(BaseModel):
@@ -49,6 +55,55 @@ class GraphStateResponse(BaseModel):
     error: Any = None
 
 
+_json_encoder = msgspec.json.Encoder()
+
+
+def _iter_log(run_state: RunState, include_log: str) -> Iterator[Dict[str, Any]]:
+    """
+    Render a run's step log, one entry at a time.
+
+    - deltas: each step with only the keys its tool returned
+    - full: each step with the full state snapshot after it ran
+
+    In full mode every entry shares one running snapshot dict, so each
+    entry must be encoded before the next one is requested.
+    """
+    full = include_log == "full"
+    snapshot = dict(run_state.initial_state)
+    for step in run_state.log:
+        entry: Dict[str, Any] = {
+            "step_index": step.step_index,
+            "node": step.node,
+            "timestamp": run_state.timestamp_of(step),
+            "version": step.version,
+        }
+        if full:
+            snapshot.update(step.delta)
+            entry["state"] = snapshot
+        else:
+            entry["delta"] = step.delta
+        yield entry
+
+
+async def _stream_run(
+    head: bytes, run_state: RunState, include_log: str
+) -> AsyncIterator[bytes]:
+    """
+    Stream a GraphRunResponse body, encoding the log step by step.
+
+    `head` is the already-encoded start of the body, up to the opening
+    bracket of the log; it is encoded before the response starts so that
+    encoding errors in final_state still surface as a 500.
+    """
+    encode = _json_encoder.encode
+    yield head
+    sep = b""
+    for entry in _iter_log(run_state, include_log):
+        yield sep + encode(entry)
+        sep = b","
+    yield b"]}"
+
+
 # ---------- Example workflow registration (Option B) ----------
 
 
@@ -115,17 +170,23 @@ async def create_graph(body: GraphCreateRequest):
     }
     """
     try:
-        graph_id = engine.create_graph(GraphConfig(**body.dict(exclude={"id"})))
+        # body is already a validated GraphConfig; create_graph assigns the id
+        graph_id = engine.create_graph(body)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     return GraphCreateResponse(graph_id=graph_id)
 
 
 @app.post("/graph/run", response_model=GraphRunResponse)
-async def run_graph(body: GraphRunRequest):
+async def run_graph(
+    body: GraphRunRequest, include_log: Optional[Literal["full", "deltas"]] = None
+):
     """
     Run a graph from the beginning with an initial state.
 
+    By default only the final state is returned; pass
+    ?include_log=deltas or ?include_log=full to get the step log too.
+
     Example body to run the example summarization graph:
 
     {
@@ -145,31 +206,56 @@ async def run_graph(body: GraphRunRequest):
     except KeyError:
         raise HTTPException(status_code=404, detail="Graph not found")
 
-    return GraphRunResponse(
-        run_id=run_state.id,
-        final_state=run_state.state,
-        status=run_state.status.value,
-        log=[step.dict() for step in run_state.log],
+    if include_log:
+        encode = _json_encoder.encode
+        head = (
+            b'{"run_id":' + encode(run_state.id)
+            + b',"final_state":' + encode(run_state.state)
+            + b',"status":' + encode(run_state.status.value)
+            + b',"log":['
+        )
+        return StreamingResponse(
+            _stream_run(head, run_state, include_log),
+            media_type="application/json",
+        )
+
+    payload = {
+        "run_id": run_state.id,
+        "final_state": run_state.state,
+        "status": run_state.status.value,
+        "log": None,
+    }
+    return Response(
+        content=_json_encoder.encode(payload), media_type="application/json"
     )
 
 
 @app.get("/graph/state/{run_id}", response_model=GraphStateResponse)
-async def get_graph_state(run_id: str):
+async def get_graph_state(run_id: str, step: Optional[int] = None):
     """
     Get the current state of a workflow run.
     For now runs are synchronous, so this typically returns the final state,
     but the structure supports long-running / async workflows later.
+
+    Pass ?step=<step_index> to get the state as it was right after that step.
     """
     try:
         run_state = engine.get_run(run_id)
     except KeyError:
         raise HTTPException(status_code=404, detail="Run not found")
 
+    state = run_state.state
+    if step is not None:
+        try:
+            state = run_state.snapshot_at(step)
+        except IndexError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
     return GraphStateResponse(
         run_id=run_state.id,
         status=run_state.status.value,
         current_node=run_state.current_node,
-        state=run_state.state,
+        state=state,
         log_length=len(run_state.log),
         error=run_state.error,
     )
@@ -1,34 +1,39 @@
 # app/tools.py
 from __future__ import annotations
 
+import re
 from typing import Any, Dict, List
 
 from .engine import ToolRegistry
 
 tools = ToolRegistry()
 
+# First '.'-separated piece with non-whitespace text, minus leading whitespace
+_FIRST_SENTENCE = re.compile(r"[^.\s][^.]*")
 
-@tools.register("split_text")
+
+# split_text and summarize_chunks scale with the input text, so they stay
+# on the thread pool instead of running inline on the event loop
+@tools.register("split_text", params={"chunk_size": (int, 80)})
 def split_text_tool(state: Dict[str, Any]) -> Dict[str, Any]:
     """
     Split input text into chunks of words.
 
     Input in state:
       - text: str
-      - chunk_size: int (optional, default 80 words)
+      - chunk_size: int (run param, default 80 words)
 
     Output:
       - chunks: List[str]
     """
     text: str = state.get("text", "") or ""
-    chunk_size: int = int(state.get("chunk_size", 80))
+    chunk_size: int = tools.read_params("split_text", state)["chunk_size"]
 
     words = text.split()
-    chunks: List[str] = []
-
-    for i in range(0, len(words), chunk_size):
-        chunk = " ".join(words[i : i + chunk_size])
-        chunks.append(chunk)
+    join = " ".join
+    chunks: List[str] = [
+        join(words[i : i + chunk_size]) for i in range(0, len(words), chunk_size)
+    ]
 
     return {"chunks": chunks}
 
@@ -41,11 +46,12 @@ def summarize_chunks_tool(state: Dict[str, Any]) -> Dict[str, Any]:
     """
     chunks: List[str] = state.get("chunks", []) or []
     summaries: List[str] = []
+    first_sentence = _FIRST_SENTENCE.search
 
     for chunk in chunks:
-        sentences = [s.strip() for s in chunk.split(".") if s.strip()]
-        if sentences:
-            candidate = sentences[0]
+        match = first_sentence(chunk)
+        if match:
+            candidate = match.group().rstrip()
         else:
             candidate = " ".join(chunk.split()[:25])
         summaries.append(candidate)
@@ -53,7 +59,7 @@ def summarize_chunks_tool(state: Dict[str, Any]) -> Dict[str, Any]:
     return {"summaries": summaries}
 
 
-@tools.register("merge_summaries")
+@tools.register("merge_summaries", cpu_light=True)
 def merge_summaries_tool(state: Dict[str, Any]) -> Dict[str, Any]:
     """
     Merge list of summaries into a single string.
@@ -64,15 +70,20 @@ def merge_summaries_tool(state: Dict[str, Any]) -> Dict[str, Any]:
     return {"merged_summary": merged}
 
 
-@tools.register("refine_summary")
+@tools.register(
+    "refine_summary",
+    cpu_light=True,
+    yield_after=True,
+    params={"target_length": (int, 120), "max_iterations": (int, 5)},
+)
 def refine_summary_tool(state: Dict[str, Any]) -> Dict[str, Any]:
     """
     Refine the merged summary until it is under a target word length.
 
     Input:
       - merged_summary: str
-      - target_length: int (default 120 words)
-      - max_iterations: int (default 5)
+      - target_length: int (run param, default 120 words)
+      - max_iterations: int (run param, default 5)
 
     Uses 'iteration' counter in state.
 
@@ -82,8 +93,9 @@ def refine_summary_tool(state: Dict[str, Any]) -> Dict[str, Any]:
       - summary_within_limit: bool
     """
     merged_summary: str = state.get("merged_summary", "") or ""
-    target_length: int = int(state.get("target_length", 120))
-    max_iterations: int = int(state.get("max_iterations", 5))
+    params = tools.read_params("refine_summary", state)
+    target_length: int = params["target_length"]
+    max_iterations: int = params["max_iterations"]
 
     iteration: int = int(state.get("iteration", 0)) + 1
     words = merged_summary.split()